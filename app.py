@@ -38,93 +38,172 @@ Notes:
 import streamlit as st
 from streamlit_folium import st_folium
 import folium
+import copy
 import io
-from folium.plugins import Draw
+import json
+from folium.plugins import Draw, FastMarkerCluster
+import numpy as np
 import pandas as pd
 import requests
-from shapely.geometry import shape, Point
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import shapely
+from shapely.geometry import shape
 from datetime import datetime, timedelta, timezone
 from typing import Any, Dict, List, Optional
 
 API_URL = "https://earthquake.usgs.gov/fdsnws/event/1/query"
+STRTREE_MIN_POLYGONS = 10  # Above this many polygons, filter via an STRtree index
+EXPORT_DECIMALS = 3  # Export rounding: hides float32 noise, may trim real digits (display choice)
+MARKER_CALLBACK = """
+function (row) {
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+        radius: 4 + row[2],
+        color: "red",
+        fill: true,
+        fillOpacity: 0.7
+    });
+    marker.bindPopup(row[3], {maxWidth: 300});
+    return marker;
+}
+"""
+
+@st.cache_resource
+def _http_session() -> requests.Session:
+    """Shared HTTP session so repeat USGS calls reuse pooled TLS connections."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=Retry(total=2, backoff_factor=0.3))
+    session.mount('https://', adapter)
+    return session
+
+@st.cache_data(ttl=300, max_entries=64, show_spinner=False)
+def fetch_data(params_tuple: tuple) -> bytes:
+    """Fetch raw earthquake data from USGS API with given parameters.
 
-def fetch_data(params: Dict[str, Any]) -> Dict[str, Any]:
-    """Fetch earthquake data from USGS API with given parameters."""
-    try:
-        resp = requests.get(API_URL, params=params, timeout=30)
-        resp.raise_for_status()
-        return resp.json()
-    except Exception as e:
-        st.error(f"API request failed: {e}")
-        return {}
+    Parameters are passed as a sorted tuple of (key, value) pairs so the call is
+    hashable and identical queries are served from the cache. Errors propagate
+    so that failed requests are never cached.
+    """
+    resp = _http_session().get(API_URL, params=dict(params_tuple), timeout=30)
+    resp.raise_for_status()
+    return resp.content
 
 def normalize_data(geojson: Dict[str, Any]) -> pd.DataFrame:
     """Normalize GeoJSON features to pandas DataFrame and process columns."""
     if not geojson or "features" not in geojson or not geojson["features"]:
         return pd.DataFrame()
-    df = pd.json_normalize(geojson["features"])
+    features = geojson["features"]
+    # Only pull the properties we use instead of flattening every field
+    df = pd.DataFrame.from_records(
+        [f['properties'] for f in features],
+        columns=['time', 'mag', 'place', 'alert', 'url']
+    )
     df = df.rename(columns={
-        'properties.time': 'time_epoch',
-        'properties.mag': 'magnitude',
-        'properties.place': 'place',
-        'geometry.coordinates': 'coordinates',
-        'properties.depth': 'depth_km',
-        'properties.alert': 'alert_level',
-        'properties.url': 'url',
+        'time': 'time_epoch',
+        'mag': 'magnitude',
+        'alert': 'alert_level',
     })
+    df['coordinates'] = [f['geometry']['coordinates'] for f in features]
     # Time conversion and flatten coordinates
     df['time_utc'] = pd.to_datetime(df['time_epoch'], unit='ms', utc=True)
-    df['longitude'] = df['coordinates'].apply(lambda x: x[0])
-    df['latitude'] = df['coordinates'].apply(lambda x: x[1])
-    df['depth_km'] = df['coordinates'].apply(lambda x: x[2] if len(x) > 2 else None)
-    # Create clickable link for USGS event
-    df['details'] = df.apply(lambda row: f'<a href="{row["url"]}" target="_blank">Detail</a>', axis=1)
-    cols = ['time_utc', 'magnitude', 'place', 'latitude', 'longitude', 'depth_km', 'alert_level', 'url', 'details']
+    # One pass over the coordinates; rows without a depth are padded with NaN
+    coords = pd.DataFrame(df['coordinates'].tolist(), index=df.index).reindex(columns=range(3))
+    coords.columns = ['longitude', 'latitude', 'depth_km']
+    df = pd.concat([df.drop(columns=['coordinates']), coords.astype(float)], axis=1)
+    cols = ['time_utc', 'magnitude', 'place', 'latitude', 'longitude', 'depth_km', 'alert_level', 'url']
     cols = [c for c in cols if c in df.columns]  # Select only present columns
-    return df[cols]
+    df = df[cols].copy()
+    # Compact dtypes: float32 magnitude/depth, category for the few alert levels
+    for col in ('magnitude', 'depth_km'):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], downcast='float')
+    if 'alert_level' in df.columns:
+        df['alert_level'] = df['alert_level'].astype('category')
+    return df
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def _normalize(geojson_bytes: bytes) -> pd.DataFrame:
+    """Parse and normalize a raw GeoJSON response, cached on its bytes."""
+    return normalize_data(json.loads(geojson_bytes))
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def _shapes(polygons_json: str) -> List[Any]:
+    """Build shapely geometries for the drawn polygons, cached on their JSON."""
+    return [shape(poly['geometry']) for poly in json.loads(polygons_json) if 'geometry' in poly]
+
+def _ray_cast_mask(shapes: List[Any], lons: np.ndarray, lats: np.ndarray) -> np.ndarray:
+    """Even-odd ray-casting point-in-polygon test, vectorized over points."""
+    mask = np.zeros(lons.size, dtype=bool)
+    for geom in shapes:
+        for part in getattr(geom, 'geoms', [geom]):
+            inside = np.zeros(lons.size, dtype=bool)
+            for ring in [part.exterior, *part.interiors]:
+                xy = np.asarray(ring.coords)
+                for (xa, ya), (xb, yb) in zip(xy[:-1], xy[1:]):
+                    crosses = (ya > lats) != (yb > lats)
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        x_cross = xa + (lats - ya) * (xb - xa) / (yb - ya)
+                    inside ^= crosses & (lons < x_cross)
+            mask |= inside
+    return mask
 
 def filter_with_polygons(df: pd.DataFrame, polygons: List[Dict]) -> pd.DataFrame:
     """Filter DataFrame rows to those inside any drawn polygon."""
     if not polygons or df.empty:
         return df
-    shapes = [shape(poly['geometry']) for poly in polygons if 'geometry' in poly]
-    def inside_any_poly(lat, lon):
-        pt = Point(lon, lat)
-        return any(poly.contains(pt) for poly in shapes)
-    mask = df.apply(lambda row: inside_any_poly(row['latitude'], row['longitude']), axis=1)
+    shapes = _shapes(json.dumps(polygons, sort_keys=True))
+    if not shapes:
+        return df
+    lons = df['longitude'].to_numpy(dtype=float)
+    lats = df['latitude'].to_numpy(dtype=float)
+    if not hasattr(shapely, 'contains_xy'):
+        # Shapely < 2.0 has no vectorized predicates
+        mask = _ray_cast_mask(shapes, lons, lats)
+    elif len(shapes) > STRTREE_MIN_POLYGONS:
+        # Spatial index: only test points against polygons whose bounds they hit.
+        # The predicate is evaluated as predicate(point, tree_polygon), so it must
+        # be 'within'; 'contains' would ask whether a point contains a polygon.
+        tree = shapely.STRtree(shapes)
+        hits = tree.query(shapely.points(lons, lats), predicate='within')
+        mask = np.zeros(len(df), dtype=bool)
+        mask[hits[0]] = True
+    else:
+        # Test each shape separately: unioning self-intersecting drawings raises
+        mask = np.zeros(len(df), dtype=bool)
+        for geom in shapes:
+            mask |= shapely.contains_xy(geom, lons, lats)
     return df[mask]
 
 def get_bounding_box(polygons: List[Dict]) -> Optional[Dict[str, float]]:
     """Compute overall bounding box from multiple polygons (min/max lat/lon)."""
     if not polygons:
         return None
-    lats, lons = [], []
+    pieces = []
     for poly in polygons:
         try:
-            coords = []
-            # Polygon or MultiPolygon
+            # Polygon or MultiPolygon: outer ring(s) only
             geom = poly['geometry']
             if geom['type'] == 'Polygon':
-                coords = geom['coordinates'][0]
+                pieces.append(np.asarray(geom['coordinates'][0], dtype=float))
             elif geom['type'] == 'MultiPolygon':
-                for sub in geom['coordinates']:
-                    coords.extend(sub[0])
-            for lon, lat in coords:
-                lats.append(lat)
-                lons.append(lon)
+                pieces.extend(np.asarray(sub[0], dtype=float) for sub in geom['coordinates'])
         except Exception:
             continue
-    if not lats or not lons:
+    pieces = [p for p in pieces if p.ndim == 2 and p.shape[0] and p.shape[1] >= 2]
+    if not pieces:
         return None
+    arr = np.concatenate([p[:, :2] for p in pieces])
+    lo, hi = arr.min(axis=0), arr.max(axis=0)
     return {
-        'minlatitude': min(lats),
-        'maxlatitude': max(lats),
-        'minlongitude': min(lons),
-        'maxlongitude': max(lons)
+        'minlatitude': float(lo[1]),
+        'maxlatitude': float(hi[1]),
+        'minlongitude': float(lo[0]),
+        'maxlongitude': float(hi[0])
     }
 
-def build_map(polygons: Optional[List[Dict]], earthquakes_df: Optional[pd.DataFrame]) -> Dict[str, Any]:
-    """Build Folium map with drawing controls and earthquake markers."""
+@st.cache_resource
+def _base_map() -> folium.Map:
+    """Build the static base map (tiles + drawing controls) once per process."""
     m = folium.Map(location=[39, 35], zoom_start=2, control_scale=True)
 
     # Draw controls
@@ -142,29 +221,85 @@ def build_map(polygons: Optional[List[Dict]], earthquakes_df: Optional[pd.DataFr
         edit_options={'edit': True, 'remove': True}
     )
     draw.add_to(m)
+    return m
 
-    # Existing polygons
-    if polygons:
-        for poly in polygons:
-            folium.GeoJson(poly).add_to(m)
+def build_map(earthquakes_df: Optional[pd.DataFrame]) -> Dict[str, Any]:
+    """Build Folium map with drawing controls and earthquake markers.
+
+    Markers go in a FeatureGroup passed via ``feature_group_to_add``: it is left
+    out of st_folium's widget key, so the map (and the user's drawings) is not
+    remounted when the results change.
+    """
+    # st_folium adds the feature group to the map it is given; keep the cached one clean
+    m = copy.deepcopy(_base_map())
+    fg = folium.FeatureGroup(name="Query results")
 
     # Earthquake markers
     if earthquakes_df is not None and not earthquakes_df.empty:
-        for _, row in earthquakes_df.iterrows():
-            popup = folium.Popup(
-                f"<b>{row['place']}</b><br>Magnitude: {row['magnitude']}<br><a href='{row['url']}' target='_blank'>Details</a>",
-                max_width=300
-            )
-            folium.CircleMarker(
-                location=(row['latitude'], row['longitude']),
-                radius=4 + row['magnitude'],
-                color="red",
-                fill=True,
-                fill_opacity=0.7,
-                popup=popup
-            ).add_to(m)
-
-    return st_folium(m, height=500, width=800, returned_objects=['all_drawings'])
+        popups = (
+            "<b>" + earthquakes_df['place'].astype(str) + "</b><br>Magnitude: "
+            + earthquakes_df['magnitude'].astype(str) + "<br><a href='"
+            + earthquakes_df['url'].astype(str) + "' target='_blank'>Details</a>"
+        )
+        markers = earthquakes_df[['latitude', 'longitude']].assign(
+            magnitude=earthquakes_df['magnitude'].fillna(0).astype(float), popup=popups
+        )
+        # Markers are built client-side from the raw rows: [lat, lon, magnitude, popup]
+        FastMarkerCluster(markers.to_numpy().tolist(), callback=MARKER_CALLBACK).add_to(fg)
+
+    return st_folium(m, feature_group_to_add=fg, height=500, width=800, returned_objects=['all_drawings'])
+
+def _for_export(df: pd.DataFrame) -> pd.DataFrame:
+    """Widen float32 columns back to float64 so exports show e.g. 5.3, not 5.300000190734863."""
+    df = df.copy()
+    for col in df.select_dtypes('float32').columns:
+        df[col] = df[col].astype('float64').round(EXPORT_DECIMALS)
+    return df
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def to_csv_bytes(df: pd.DataFrame) -> bytes:
+    """Serialize results to CSV, cached per unique DataFrame."""
+    return _for_export(df).to_csv(index=False).encode()
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def to_xlsx_bytes(df: pd.DataFrame) -> bytes:
+    """Serialize results to an Excel workbook, cached per unique DataFrame."""
+    df = _for_export(df)
+    # Remove timezone info for Excel
+    if "time_utc" in df.columns:
+        df["time_utc"] = df["time_utc"].dt.tz_localize(None)
+    output = io.BytesIO()
+    # No constant_memory: pandas writes column by column, which that mode drops
+    with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
+        df.to_excel(writer, index=False)
+    return output.getvalue()
+
+@st.experimental_fragment
+def _results_fragment(df: pd.DataFrame) -> None:
+    """Render the results table and export buttons.
+
+    Runs as a fragment so widget interactions here rerun only this block,
+    not the fetch/filter pipeline in main().
+    """
+    st.subheader("3. Results")
+    # Client-side grid; the USGS event page is shown as a link column
+    display_cols = ['time_utc', 'magnitude', 'place', 'latitude', 'longitude', 'depth_km', 'alert_level', 'url']
+    st.dataframe(
+        df[display_cols],
+        hide_index=True,
+        column_config={
+            'url': st.column_config.LinkColumn('Details', display_text='Open'),
+            'time_utc': st.column_config.DatetimeColumn(),
+        }
+    )
+    with st.expander("Download results"):
+        st.download_button("Export as CSV", data=to_csv_bytes(df), file_name="earthquakes.csv", mime="text/csv")
+        st.download_button(
+            "Export as Excel",
+            data=to_xlsx_bytes(df),
+            file_name="earthquakes.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        )
 
 def main():
     st.set_page_config("Earthquake Explorer", "🌍", layout="wide")
@@ -193,22 +328,27 @@ def main():
 
     st.sidebar.markdown("**Location filter:** Draw one or more polygons or rectangles on the map below.")
 
-    # Map drawing widget
-    st.subheader("1. Select region (draw polygons/rectangles)")
-    map_result = build_map(None, None)
-    polygons = map_result.get('all_drawings', [])
-
-    st.subheader("2. Set filters & click to list earthquakes")
-    query = st.button("List Earthquakes")
-
     # State: Track if initial query has run
     if "run_query" not in st.session_state:
         st.session_state.run_query = False
+    df = st.session_state.get("df", pd.DataFrame())
 
-    df = pd.DataFrame()
+    # Single map: drawing widget plus the markers of the last query
+    st.subheader("1. Select region (draw polygons/rectangles)")
+    # Drawn shapes stay editable in the Draw layer, so only the markers are added
+    map_result = build_map(df)
+    polygons = map_result.get('all_drawings') or []
+
+    st.subheader("2. Set filters & click to list earthquakes")
+    query = st.button("List Earthquakes")
+    if st.session_state.get("query_error"):
+        st.error(st.session_state.query_error)
 
     # Run query if (button pressed) or (first load, and not yet queried)
     if query or not st.session_state.run_query:
+        # Drop the previous result first so old and new frames never coexist
+        st.session_state.pop("df", None)
+        df = None
         with st.spinner("Fetching data from USGS..."):
             params = {
                 "format": "geojson",
@@ -224,53 +364,31 @@ def main():
             bbox = get_bounding_box(polygons)
             if bbox:
                 params.update(bbox)
-            geojson = fetch_data(params)
-            df = normalize_data(geojson)
+            st.session_state.query_error = None
+            try:
+                df = _normalize(fetch_data(tuple(sorted(params.items()))))
+            except Exception as e:
+                # Shown after the rerun below
+                st.session_state.query_error = f"API request failed: {e}"
+                df = pd.DataFrame()
             # Polygon strict filtering (after bbox) if needed
             if polygons:
                 df = filter_with_polygons(df, polygons)
         st.session_state.run_query = True
         st.session_state.df = df
-    else:
-        df = st.session_state.get("df", pd.DataFrame())
+        # Rerun so the map above picks up the new markers
+        st.rerun()
 
     # Display results
     if not df.empty:
-        st.subheader("3. Earthquake Map with Markers")
-        build_map(polygons, df)
-        # Show with clickable HTML links
-        styled_df = df.copy()
-        styled_df['place'] = styled_df.apply(
-            lambda row: f'<a href="{row["url"]}" target="_blank">{row["place"]}</a>'
-            if pd.notna(row.get("place")) and pd.notna(row.get("url", None)) else (row.get("place", "") or ""), axis=1
-        )
-
-        # Only show columns for display
-        display_cols = ['time_utc', 'magnitude', 'place', 'latitude', 'longitude', 'depth_km', 'alert_level', 'details']
-        st.markdown(
-            styled_df[display_cols].to_html(escape=False, index=False),
-            unsafe_allow_html=True
-        )
-        with st.expander("Download results"):
-            st.download_button("Export as CSV", data=styled_df.to_csv(index=False), file_name="earthquakes.csv", mime="text/csv")
-            # Remove timezone info for Excel
-            if "time_utc" in styled_df.columns:
-                styled_df["time_utc"] = styled_df["time_utc"].dt.tz_localize(None)
-            output = io.BytesIO()
-            with pd.ExcelWriter(output, engine='openpyxl') as writer:
-                styled_df.to_excel(writer, index=False)
-            st.download_button(
-                "Export as Excel",
-                data=output.getvalue(),
-                file_name="earthquakes.xlsx",
-                mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
+        _results_fragment(df)
         # Stats
         st.sidebar.markdown("## 📊 Stats")
+        stats = df.agg({'magnitude': ['mean', 'max'], 'depth_km': ['max']})
         st.sidebar.write(f"Total quakes: **{len(df)}**")
-        st.sidebar.write(f"Mean magnitude: **{df['magnitude'].mean():.2f}**")
-        st.sidebar.write(f"Deepest: **{df['depth_km'].max():.1f} km**")
-        st.sidebar.write(f"Largest: **{df['magnitude'].max():.1f}**")
+        st.sidebar.write(f"Mean magnitude: **{stats.loc['mean', 'magnitude']:.2f}**")
+        st.sidebar.write(f"Deepest: **{stats.loc['max', 'depth_km']:.1f} km**")
+        st.sidebar.write(f"Largest: **{stats.loc['max', 'magnitude']:.1f}**")
     elif st.session_state.run_query:
         st.warning("No earthquakes found with the selected filters.")
 
@@ -0,0 +1,40 @@
+import io
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+from app import to_csv_bytes, to_xlsx_bytes
+
+NS = {'x': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+
+def _sheet_rows(xlsx: bytes):
+    """Return the cell references of each row in the first worksheet."""
+    with zipfile.ZipFile(io.BytesIO(xlsx)) as zf:
+        root = ET.fromstring(zf.read('xl/worksheets/sheet1.xml'))
+    return [[c.get('r') for c in row.findall('x:c', NS)] for row in root.iter(f"{{{NS['x']}}}row")]
+
+
+def test_xlsx_export_keeps_every_cell():
+    df = pd.DataFrame({
+        'time_utc': pd.to_datetime(['2024-01-01', '2024-01-02', '2024-01-03'], utc=True),
+        'magnitude': [6.1, 5.3, 7.0],
+        'place': ['A', 'B', 'C'],
+        'depth_km': [10.0, 22.5, 35.0],
+    })
+    rows = _sheet_rows(to_xlsx_bytes(df))
+    assert len(rows) == len(df) + 1  # header + data
+    assert all(len(cells) == len(df.columns) for cells in rows)
+
+
+def test_exports_do_not_show_float32_noise():
+    df = pd.DataFrame({
+        'magnitude': pd.Series([5.3, 6.1], dtype='float32'),
+        'depth_km': pd.Series([10.7, 687.123], dtype='float32'),
+    })
+    with zipfile.ZipFile(io.BytesIO(to_xlsx_bytes(df))) as zf:
+        sheet = zf.read('xl/worksheets/sheet1.xml').decode()
+    for value in ('5.3', '6.1', '10.7', '687.123'):
+        assert f'<v>{value}</v>' in sheet
+    assert to_csv_bytes(df).decode().splitlines()[1:] == ['5.3,10.7', '6.1,687.123']
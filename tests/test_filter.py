@@ -0,0 +1,53 @@
+import numpy as np
+import pandas as pd
+import shapely
+from shapely.geometry import MultiPolygon, Polygon
+
+from app import STRTREE_MIN_POLYGONS, _ray_cast_mask, filter_with_polygons
+
+
+def _polygon(ring):
+    return {'type': 'Feature', 'geometry': {'type': 'Polygon', 'coordinates': [ring]}}
+
+
+# Self-intersecting "bow-tie", which Leaflet.draw allows users to draw
+BOW_TIE = _polygon([[0, 0], [10, 10], [10, 0], [0, 10], [0, 0]])
+SQUARE = _polygon([[20, 20], [30, 20], [30, 30], [20, 30], [20, 20]])
+
+POINTS = pd.DataFrame({
+    'place': ['left lobe', 'right lobe', 'between lobes', 'square', 'outside'],
+    'longitude': [1.0, 9.0, 5.0, 25.0, 50.0],
+    'latitude': [5.0, 5.0, 1.0, 25.0, 50.0],
+})
+EXPECTED = ['left lobe', 'right lobe', 'square']
+
+
+def test_self_intersecting_polygon_with_other_shapes():
+    result = filter_with_polygons(POINTS, [BOW_TIE, SQUARE])
+    assert result['place'].tolist() == EXPECTED
+
+
+def test_self_intersecting_polygon_with_strtree():
+    polygons = [BOW_TIE] + [SQUARE] * STRTREE_MIN_POLYGONS
+    assert len(polygons) > STRTREE_MIN_POLYGONS
+    result = filter_with_polygons(POINTS, polygons)
+    assert result['place'].tolist() == EXPECTED
+
+
+def test_ray_cast_fallback_matches_shapely():
+    """The shapely < 2.0 fallback must agree with contains_xy, holes included."""
+    holed = Polygon(
+        [(0, 0), (20, 0), (20, 20), (0, 20)],
+        holes=[[(5, 5), (15, 5), (15, 15), (5, 15)]],
+    )
+    multi = MultiPolygon([
+        Polygon([(30, 30), (40, 30), (35, 45)]),
+        Polygon([(-20, -20), (-5, -18), (-8, -2), (-19, -6)]),
+    ])
+    rng = np.random.default_rng(0)
+    lons = rng.uniform(-25, 50, 20000)
+    lats = rng.uniform(-25, 50, 20000)
+
+    expected = shapely.contains_xy(holed, lons, lats) | shapely.contains_xy(multi, lons, lats)
+    assert expected.any()
+    np.testing.assert_array_equal(_ray_cast_mask([holed, multi], lons, lats), expected)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from app import normalize_data
+
+
+def _feature(coordinates, mag, place, alert):
+    return {
+        'type': 'Feature',
+        'properties': {
+            'time': 1700000000000, 'mag': mag, 'place': place,
+            'alert': alert, 'url': 'https://earthquake.usgs.gov/x',
+        },
+        'geometry': {'type': 'Point', 'coordinates': coordinates},
+    }
+
+
+def test_mixed_2d_and_3d_coordinates():
+    geojson = {'features': [
+        _feature([35.0, 39.0, 10.5], 6.1, 'Turkey', 'green'),
+        _feature([140.0, 36.0], None, None, None),
+    ]}
+    df = normalize_data(geojson)
+
+    assert df['longitude'].tolist() == [35.0, 140.0]
+    assert df['latitude'].tolist() == [39.0, 36.0]
+    assert df['depth_km'].iloc[0] == np.float32(10.5)
+    assert np.isnan(df['depth_km'].iloc[1])
+    assert np.isnan(df['magnitude'].iloc[1])
+
+    assert df['magnitude'].dtype == np.float32
+    assert df['depth_km'].dtype == np.float32
+    assert df['alert_level'].dtype == 'category'
+    assert df['alert_level'].isna().tolist() == [False, True]
+
+
+def test_empty_response():
+    assert normalize_data({'features': []}).empty